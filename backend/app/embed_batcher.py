@@ -0,0 +1,65 @@
+"""Micro-batching of concurrent embedding requests for PrajwalGPT."""
+
+import asyncio
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+
+BatchEmbedder = Callable[[List[str]], Awaitable[List[List[float]]]]
+
+
+class EmbedBatcher:
+    """Coalesces concurrent embedding requests into one batched call.
+
+    Texts submitted through :meth:`process` are queued until either
+    ``max_batch_size`` texts are waiting or ``max_queue_time`` seconds have
+    passed since the first one arrived; the whole batch is then embedded with a
+    single ``process_batch`` call and each caller receives its own vector.
+    """
+
+    def __init__(self, process_batch: BatchEmbedder, max_batch_size: int = 32, max_queue_time: float = 0.02):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_queue_time = max_queue_time
+
+        self._pending: List[Tuple[str, "asyncio.Future[List[float]]"]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._in_flight: Set["asyncio.Task[None]"] = set()
+
+    async def process(self, text: str) -> List[float]:
+        """Embed ``text`` as part of the next batch."""
+        loop = asyncio.get_running_loop()
+        future: "asyncio.Future[List[float]]" = loop.create_future()
+        self._pending.append((text, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_queue_time, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            # Keep a reference so the task is not garbage collected mid-flight
+            task = asyncio.create_task(self._run(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _run(self, batch: List[Tuple[str, "asyncio.Future[List[float]]"]]) -> None:
+        try:
+            embeddings = await self.process_batch([text for text, _ in batch])
+            if len(embeddings) != len(batch):
+                raise RuntimeError(f"Expected {len(batch)} embeddings, got {len(embeddings)}")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
@@ -1,19 +1,137 @@
 """Minimal FastAPI application bootstrapped for the PrajwalGPT backend."""
 
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict, Any
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict
+from typing import AsyncIterator, Final, List, Dict, Any, Optional
 import httpx
 
 from shared import get_settings
 from .ollama_client import ollama_client
 from .rag_system import rag_retriever
+from .semantic_cache import SemanticCache
+
+# Responses for near-duplicate queries, one cache per endpoint since their shapes differ
+chat_rag_cache = SemanticCache()
+generate_rag_cache = SemanticCache()
+
+# Predefined context about Prajwal based on the documents
+PRAJWAL_CONTEXT: Final[str] = """
+Prajwal is a passionate developer working with Natural Language Processing and AI systems.
+
+Skills and Interests:
+- Programming Languages: Python, JavaScript, TypeScript
+- AI/ML Technologies: Large Language Models (LLMs), RAG, Vector databases, Ollama
+- Backend: FastAPI, async programming, database design
+- Frontend: React, TypeScript, Vite, responsive design
+- Tools: VS Code, Git, Docker, UV package manager
+
+Current Projects:
+- PrajwalGPT: A personal RAG-based AI assistant using Ollama, FastAPI, React
+- Focus on privacy-focused local LLM processing
+- Building efficient RAG workflows and personalized AI systems
+"""
+
+# Identical on every /chat/simple request, so Ollama can keep its prefill cached
+PRAJWAL_SYSTEM_PROMPT: Final[str] = f"""You are PrajwalGPT, an AI assistant that knows about Prajwal. 
+
+CONTEXT ABOUT PRAJWAL:
+{PRAJWAL_CONTEXT}
+
+INSTRUCTIONS:
+- Answer questions about Prajwal based on the context provided
+- Be helpful and informative when discussing Prajwal's work and skills
+- If asked about topics not related to Prajwal, politely redirect to discussing Prajwal
+- Keep responses concise but informative"""
+
+# Prompt templates for the RAG endpoints, filled in per request with str.format_map
+RAG_SYSTEM_TMPL: Final[str] = """You are PrajwalGPT, an AI assistant that knows about Prajwal based on the provided documents. 
+
+IMPORTANT INSTRUCTIONS:
+- Only answer questions about Prajwal based on the provided context
+- If the question is not about Prajwal or if you don't have relevant information in the context, politely say you can only discuss Prajwal based on the available documents
+- Be helpful and informative when answering about Prajwal
+- Always reference the documents when providing information
+
+CONTEXT FROM PRAJWAL'S DOCUMENTS:
+{context}
+
+Please answer the user's question based on this context."""
+
+RAG_SYSTEM_FALLBACK: Final[str] = """You are PrajwalGPT, an AI assistant that knows about Prajwal. However, I don't have any relevant documents loaded about Prajwal yet. 
+
+Please let the user know that:
+1. You're designed to answer questions about Prajwal based on his documents
+2. No relevant documents are currently available
+3. They should add documents about Prajwal to the storage/documents/ folder and run the ingestion process"""
+
+RAG_SYSTEM_OFF_TOPIC: Final[str] = """You are PrajwalGPT, an AI assistant that knows about Prajwal based on his documents. None of those documents are relevant to the user's question.
+
+Politely let the user know that you can only discuss Prajwal, and suggest they ask about his background, projects or skills instead. Do not answer the question from general knowledge."""
+
+RAG_GEN_TMPL: Final[str] = """You are PrajwalGPT, an AI assistant that knows about Prajwal based on the provided documents.
+
+IMPORTANT: Only answer questions about Prajwal based on the provided context. If the question is not about Prajwal, politely redirect to topics about Prajwal.
+
+CONTEXT FROM PRAJWAL'S DOCUMENTS:
+{context}
+
+USER QUESTION: {query}
+
+Please answer based on the context above."""
+
+RAG_GEN_FALLBACK_TMPL: Final[str] = """You are PrajwalGPT, but I don't have any documents about Prajwal loaded yet. Please let the user know they should add documents about Prajwal to the storage/documents/ folder and run the ingestion process.
+
+USER QUESTION: {query}"""
+
+RAG_GEN_OFF_TOPIC_TMPL: Final[str] = """You are PrajwalGPT, and none of Prajwal's documents are relevant to the question below. Politely let the user know that you can only discuss Prajwal, and suggest they ask about his background, projects or skills instead. Do not answer the question from general knowledge.
+
+USER QUESTION: {query}"""
+
+
+async def warm_up_ollama() -> None:
+    """Report the negotiated HTTP version, then prime the /chat/simple system prompt."""
+
+    try:
+        print(f"🔌 Ollama connection uses {await ollama_client.http_version()}")
+    except Exception as e:
+        print(f"⚠️ Could not reach Ollama: {e}")
+    await ollama_client.prime_system_prompt(PRAJWAL_SYSTEM_PROMPT)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Share one pooled HTTP client with every Ollama caller for the app's lifetime."""
+
+    settings = get_settings()
+    # HTTP/2 multiplexes concurrent requests over one connection where the server offers it
+    app.state.http = httpx.AsyncClient(
+        base_url=settings.ollama_host,
+        http2=True,
+        timeout=httpx.Timeout(120.0, connect=5.0),
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60),
+    )
+    ollama_client.bind_client(app.state.http)
+    rag_retriever.bind_client(app.state.http)
+    priming = asyncio.create_task(warm_up_ollama())
+    try:
+        yield
+    finally:
+        priming.cancel()
+        ollama_client.bind_client(None)
+        rag_retriever.bind_client(None)
+        await app.state.http.aclose()
+
 
 app = FastAPI(
     title="PrajwalGPT API",
     version="0.1.0",
     summary="Backend service for orchestrating retrieval-augmented generation workflows.",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 # Add CORS middleware
@@ -26,19 +144,35 @@ app.add_middleware(
 )
 
 
-class ChatMessage(BaseModel):
+class RequestModel(BaseModel):
+    """Immutable request body; unknown fields are dropped rather than validated."""
+
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
+
+class ChatMessage(RequestModel):
     role: str  # "user", "assistant", "system"
     content: str
 
 
-class ChatRequest(BaseModel):
+class ChatRequest(RequestModel):
     messages: List[ChatMessage]
 
 
-class GenerateRequest(BaseModel):
+class GenerateRequest(RequestModel):
     prompt: str
 
 
+async def embed_for_cache(query: str) -> Optional[List[float]]:
+    """Embed a query for cache lookup; ``None`` means skip caching for this request."""
+
+    try:
+        return await rag_retriever.get_query_embedding(query)
+    except Exception as e:
+        print(f"⚠️ Semantic cache unavailable: {e}")
+        return None
+
+
 @app.get("/health", tags=["meta"])
 def healthcheck() -> dict[str, str]:
     """Simple health endpoint that surfaces the configured model."""
@@ -68,23 +202,6 @@ async def chat_simple_with_context(request: ChatRequest) -> Dict[str, Any]:
     """Simple chat with predefined context about Prajwal."""
     
     try:
-        # Predefined context about Prajwal based on the documents
-        prajwal_context = """
-        Prajwal is a passionate developer working with Natural Language Processing and AI systems.
-
-        Skills and Interests:
-        - Programming Languages: Python, JavaScript, TypeScript
-        - AI/ML Technologies: Large Language Models (LLMs), RAG, Vector databases, Ollama
-        - Backend: FastAPI, async programming, database design
-        - Frontend: React, TypeScript, Vite, responsive design
-        - Tools: VS Code, Git, Docker, UV package manager
-
-        Current Projects:
-        - PrajwalGPT: A personal RAG-based AI assistant using Ollama, FastAPI, React
-        - Focus on privacy-focused local LLM processing
-        - Building efficient RAG workflows and personalized AI systems
-        """
-
         # Get the latest user message
         user_messages = [msg for msg in request.messages if msg.role == "user"]
         if not user_messages:
@@ -92,23 +209,8 @@ async def chat_simple_with_context(request: ChatRequest) -> Dict[str, Any]:
         
         latest_query = user_messages[-1].content
 
-        # Build enhanced prompt with context - use generate format instead of chat
-        enhanced_prompt = f"""You are PrajwalGPT, an AI assistant that knows about Prajwal. 
-
-CONTEXT ABOUT PRAJWAL:
-{prajwal_context}
-
-INSTRUCTIONS:
-- Answer questions about Prajwal based on the context provided
-- Be helpful and informative when discussing Prajwal's work and skills
-- If asked about topics not related to Prajwal, politely redirect to discussing Prajwal
-- Keep responses concise but informative
-
-USER QUESTION: {latest_query}
-
-RESPONSE:"""
-
-        response = await ollama_client.generate(enhanced_prompt)
+        # The static context goes in the system prompt so Ollama reuses its prefill
+        response = await ollama_client.generate(latest_query, system=PRAJWAL_SYSTEM_PROMPT)
         return response
         
     except httpx.HTTPError as e:
@@ -129,41 +231,34 @@ async def chat_with_rag(request: ChatRequest) -> Dict[str, Any]:
         
         latest_query = user_messages[-1].content
         
+        query_embedding = await embed_for_cache(latest_query)
+        # The reply depends on the whole history, so only fresh conversations are cacheable
+        cacheable = query_embedding is not None and len(request.messages) == 1
+        if cacheable:
+            cached = chat_rag_cache.get(query_embedding)
+            if cached is not None:
+                return cached
+        
         # Get relevant context from documents
-        context = await rag_retriever.get_context_for_query(latest_query)
+        context = await rag_retriever.get_context_for_query(latest_query, query_embedding=query_embedding)
         
         # Build enhanced prompt
-        if context:
-            system_prompt = f"""You are PrajwalGPT, an AI assistant that knows about Prajwal based on the provided documents. 
-
-IMPORTANT INSTRUCTIONS:
-- Only answer questions about Prajwal based on the provided context
-- If the question is not about Prajwal or if you don't have relevant information in the context, politely say you can only discuss Prajwal based on the available documents
-- Be helpful and informative when answering about Prajwal
-- Always reference the documents when providing information
-
-CONTEXT FROM PRAJWAL'S DOCUMENTS:
-{context}
-
-Please answer the user's question based on this context."""
-
-            enhanced_messages = [
-                {"role": "system", "content": system_prompt}
-            ] + [{"role": msg.role, "content": msg.content} for msg in request.messages]
+        if context is None:
+            # Documents are loaded but none relate to the question
+            system_prompt = RAG_SYSTEM_OFF_TOPIC
+        elif context:
+            system_prompt = RAG_SYSTEM_TMPL.format_map({"context": context})
         else:
-            # No context found
-            fallback_prompt = """You are PrajwalGPT, an AI assistant that knows about Prajwal. However, I don't have any relevant documents loaded about Prajwal yet. 
-
-Please let the user know that:
-1. You're designed to answer questions about Prajwal based on his documents
-2. No relevant documents are currently available
-3. They should add documents about Prajwal to the storage/documents/ folder and run the ingestion process"""
+            # No documents loaded
+            system_prompt = RAG_SYSTEM_FALLBACK
 
-            enhanced_messages = [
-                {"role": "system", "content": fallback_prompt}
-            ] + [{"role": msg.role, "content": msg.content} for msg in request.messages]
+        enhanced_messages = [
+            {"role": "system", "content": system_prompt}
+        ] + [{"role": msg.role, "content": msg.content} for msg in request.messages]
 
         response = await ollama_client.chat(enhanced_messages)
+        if cacheable:
+            chat_rag_cache.add(query_embedding, response)
         return response
         
     except httpx.HTTPError as e:
@@ -177,27 +272,26 @@ async def generate_with_rag(request: GenerateRequest) -> Dict[str, Any]:
     """Generate text with RAG - uses your documents as context."""
     
     try:
+        query_embedding = await embed_for_cache(request.prompt)
+        if query_embedding is not None:
+            cached = generate_rag_cache.get(query_embedding)
+            if cached is not None:
+                return cached
+        
         # Get relevant context
-        context = await rag_retriever.get_context_for_query(request.prompt)
+        context = await rag_retriever.get_context_for_query(request.prompt, query_embedding=query_embedding)
         
         # Build enhanced prompt
-        if context:
-            enhanced_prompt = f"""You are PrajwalGPT, an AI assistant that knows about Prajwal based on the provided documents.
-
-IMPORTANT: Only answer questions about Prajwal based on the provided context. If the question is not about Prajwal, politely redirect to topics about Prajwal.
-
-CONTEXT FROM PRAJWAL'S DOCUMENTS:
-{context}
-
-USER QUESTION: {request.prompt}
-
-Please answer based on the context above."""
+        if context is None:
+            enhanced_prompt = RAG_GEN_OFF_TOPIC_TMPL.format_map({"query": request.prompt})
+        elif context:
+            enhanced_prompt = RAG_GEN_TMPL.format_map({"context": context, "query": request.prompt})
         else:
-            enhanced_prompt = f"""You are PrajwalGPT, but I don't have any documents about Prajwal loaded yet. Please let the user know they should add documents about Prajwal to the storage/documents/ folder and run the ingestion process.
-
-USER QUESTION: {request.prompt}"""
+            enhanced_prompt = RAG_GEN_FALLBACK_TMPL.format_map({"query": request.prompt})
 
         response = await ollama_client.generate(enhanced_prompt)
+        if query_embedding is not None:
+            generate_rag_cache.add(query_embedding, response)
         return response
         
     except httpx.HTTPError as e:
@@ -211,7 +305,8 @@ async def search_documents(q: str, limit: int = 5) -> Dict[str, Any]:
     """Search through your documents."""
     
     try:
-        results = await rag_retriever.search_documents(q, top_k=limit)
+        hits = await rag_retriever.search_documents(q, top_k=limit)
+        results = [rag_retriever.describe(hit) for hit in hits]
         return {
             "query": q,
             "results": results,
@@ -221,12 +316,15 @@ async def search_documents(q: str, limit: int = 5) -> Dict[str, Any]:
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
 
-@app.post("/chat", tags=["llm"])
-async def chat(request: ChatRequest) -> Dict[str, Any]:
-    """Chat with the LLM using conversation history."""
+@app.post("/chat", tags=["llm"], response_model=None)
+async def chat(request: ChatRequest, stream: bool = False) -> Dict[str, Any] | StreamingResponse:
+    """Chat with the LLM using conversation history; ``?stream=true`` returns NDJSON chunks."""
     
     try:
         messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+        if stream:
+            lines = await ollama_client.chat_stream(messages)
+            return StreamingResponse(lines, media_type="application/x-ndjson")
         response = await ollama_client.chat(messages)
         return response
     except httpx.HTTPError as e:
@@ -235,11 +333,14 @@ async def chat(request: ChatRequest) -> Dict[str, Any]:
         raise HTTPException(status_code=500, detail=f"Chat failed: {str(e)}")
 
 
-@app.post("/generate", tags=["llm"])
-async def generate(request: GenerateRequest) -> Dict[str, Any]:
-    """Generate text from a single prompt."""
+@app.post("/generate", tags=["llm"], response_model=None)
+async def generate(request: GenerateRequest, stream: bool = False) -> Dict[str, Any] | StreamingResponse:
+    """Generate text from a single prompt; ``?stream=true`` returns NDJSON chunks."""
     
     try:
+        if stream:
+            lines = await ollama_client.generate_stream(request.prompt)
+            return StreamingResponse(lines, media_type="application/x-ndjson")
         response = await ollama_client.generate(request.prompt)
         return response
     except httpx.HTTPError as e:
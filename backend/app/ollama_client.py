@@ -1,76 +1,149 @@
 """Ollama client for PrajwalGPT backend."""
 
 import httpx
-from typing import Dict, Any, List
+from typing import AsyncIterator, Dict, Any, List, Optional
 from shared import get_settings
 
 
 class OllamaClient:
     """Simple client for interacting with Ollama API."""
     
-    def __init__(self):
+    def __init__(self, client: Optional[httpx.AsyncClient] = None):
         self.settings = get_settings()
         self.base_url = self.settings.ollama_host
         self.model = self.settings.ollama_model
         self.embedding_model = self.settings.embedding_model
+        self.keep_alive = self.settings.ollama_keep_alive
+        self._client = client
     
-    async def generate(self, prompt: str, stream: bool = False) -> Dict[str, Any]:
-        """Generate text using the configured model."""
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(
-                f"{self.base_url}/api/generate",
-                json={
-                    "model": self.model,
-                    "prompt": prompt,
-                    "stream": stream
-                }
-            )
-            response.raise_for_status()
-            return response.json()
+    def bind_client(self, client: Optional[httpx.AsyncClient]) -> None:
+        """Attach the shared HTTP client (``None`` detaches it on shutdown)."""
+        self._client = client
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Return the shared HTTP client created during app startup."""
+        if self._client is None:
+            raise RuntimeError("OllamaClient has no HTTP client bound; is the app lifespan running?")
+        return self._client
+    
+    def _generate_payload(
+        self,
+        prompt: str,
+        stream: bool,
+        system: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": stream,
+            "keep_alive": self.keep_alive
+        }
+        if system is not None:
+            payload["system"] = system
+        if options is not None:
+            payload["options"] = options
+        return payload
+    
+    def _chat_payload(self, messages: List[Dict[str, str]], stream: bool) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "messages": messages,
+            "stream": stream,
+            "keep_alive": self.keep_alive
+        }
+    
+    async def generate(
+        self,
+        prompt: str,
+        system: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """Generate text using the configured model.
+
+        A fixed ``system`` prompt is placed ahead of ``prompt``, so Ollama can reuse
+        its KV cache for that prefix across requests while the model stays loaded.
+        """
+        response = await self.client.post(
+            "/api/generate", json=self._generate_payload(prompt, False, system, options)
+        )
+        response.raise_for_status()
+        return response.json()
+    
+    async def generate_stream(self, prompt: str, system: Optional[str] = None) -> AsyncIterator[str]:
+        """Start a streaming generation and return its NDJSON lines as they arrive."""
+        response = await self._open_stream("/api/generate", self._generate_payload(prompt, True, system))
+        return self._iter_lines(response)
+    
+    async def prime_system_prompt(self, system: str) -> None:
+        """Load the model and prefill ``system`` so the first real request is fast."""
+        try:
+            await self.generate("Hello", system=system, options={"num_predict": 1})
+            print("✅ Primed Ollama with the system prompt")
+        except Exception as e:
+            print(f"⚠️ Could not prime Ollama: {e}")
     
     async def chat(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
         """Chat using the configured model."""
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(
-                f"{self.base_url}/api/chat",
-                json={
-                    "model": self.model,
-                    "messages": messages,
-                    "stream": False  # Disable streaming for simpler response
-                }
-            )
+        response = await self.client.post("/api/chat", json=self._chat_payload(messages, False))
+        response.raise_for_status()
+        return response.json()
+    
+    async def chat_stream(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        """Start a streaming chat and return its NDJSON lines as they arrive."""
+        response = await self._open_stream("/api/chat", self._chat_payload(messages, True))
+        return self._iter_lines(response)
+    
+    async def _open_stream(self, path: str, payload: Dict[str, Any]) -> httpx.Response:
+        """Send a streaming request, raising on error status before any body is read."""
+        request = self.client.build_request("POST", path, json=payload)
+        response = await self.client.send(request, stream=True)
+        if response.is_error:
+            await response.aclose()
             response.raise_for_status()
-            return response.json()
+        return response
+    
+    @staticmethod
+    async def _iter_lines(response: httpx.Response) -> AsyncIterator[str]:
+        try:
+            async for line in response.aiter_lines():
+                if line:
+                    yield line + "\n"
+        finally:
+            await response.aclose()
     
     async def embed(self, text: str) -> Dict[str, Any]:
         """Generate embeddings using the configured embedding model."""
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/api/embeddings",
-                json={
-                    "model": self.embedding_model,
-                    "prompt": text
-                }
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self.client.post(
+            "/api/embeddings",
+            json={
+                "model": self.embedding_model,
+                "prompt": text
+            }
+        )
+        response.raise_for_status()
+        return response.json()
     
     async def list_models(self) -> Dict[str, Any]:
         """List available models."""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{self.base_url}/api/tags")
-            response.raise_for_status()
-            return response.json()
+        response = await self.client.get("/api/tags")
+        response.raise_for_status()
+        return response.json()
+    
+    async def http_version(self) -> str:
+        """Return the HTTP version negotiated with Ollama, e.g. ``"HTTP/2"``."""
+        response = await self.client.get("/api/tags", timeout=5.0)
+        return response.http_version
     
     async def health_check(self) -> bool:
         """Check if Ollama is running and accessible."""
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{self.base_url}/api/tags", timeout=5.0)
-                return response.status_code == 200
+            response = await self.client.get("/api/tags", timeout=5.0)
+            return response.status_code == 200
         except Exception:
             return False
 
 
 # Global instance
-ollama_client = OllamaClient()
\ No newline at end of file
+ollama_client = OllamaClient()
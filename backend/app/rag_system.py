@@ -1,26 +1,61 @@
 """RAG (Retrieval-Augmented Generation) system for PrajwalGPT."""
 
-import json
+import asyncio
+import os
 import faiss
 import numpy as np
+import pyarrow as pa
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, NamedTuple, Optional
 import httpx
 
-from shared import get_settings
+from shared import NORMALIZED_METADATA_KEY, estimate_tokens, get_settings
+from .embed_batcher import EmbedBatcher
+from .semantic_cache import SemanticCache
+
+# Lower bound on the HNSW search beam width (ignored for flat indexes).
+MIN_EF_SEARCH = 64
+
+# Queries whose best chunk scores below this cosine similarity get no context, and
+# later queries at least this similar to one of them skip retrieval altogether.
+MIN_RELEVANCE_SCORE = 0.3
+REJECT_SIMILARITY = 0.9
+_REJECTED: Dict[str, Any] = {"relevant": False}
+
+# Upper bound on FAISS's OpenMP threads, so searches from worker threads don't oversubscribe.
+MAX_SEARCH_THREADS = 4
+
+
+class Hit(NamedTuple):
+    """A single search result: metadata row index, similarity and the chunk it points to."""
+
+    idx: int
+    score: float
+    content: str
+    file: str
+    token_count: int
 
 
 class RAGRetriever:
     """Handles document retrieval and context preparation."""
     
-    def __init__(self):
+    def __init__(self, client: Optional[httpx.AsyncClient] = None):
         self.settings = get_settings()
+        self._client = client
+        self._embed_batcher = EmbedBatcher(self._embed_batch)
         self.vector_store_path = Path(self.settings.vector_store_path)
         self.index_path = self.vector_store_path / "faiss_index.bin"
-        self.metadata_path = self.vector_store_path / "metadata.json"
+        self.metadata_path = self.vector_store_path / "metadata.arrow"
         
         self._index = None
-        self._metadata = None
+        self._metadata: Optional[pa.Table] = None
+        # Hot columns looked up per hit, still backed by the memory-mapped file
+        self._content: Optional[pa.ChunkedArray] = None
+        self._file: Optional[pa.ChunkedArray] = None
+        self._token_count: Optional[pa.ChunkedArray] = None
+        self._normalized = False
+        # Embeddings of queries that matched nothing relevant, so repeats skip the index
+        self._rejected = SemanticCache(threshold=REJECT_SIMILARITY, max_entries=512)
         self._load_vector_store()
     
     def _load_vector_store(self):
@@ -34,11 +69,20 @@ class RAGRetriever:
             
             if self.index_path.exists() and self.metadata_path.exists():
                 self._index = faiss.read_index(str(self.index_path))
+                faiss.omp_set_num_threads(min(MAX_SEARCH_THREADS, os.cpu_count() or 1))
                 
-                with open(self.metadata_path, 'r', encoding='utf-8') as f:
-                    self._metadata = json.load(f)
+                # Memory-map the Arrow file: rows are paged in on demand instead of parsed up front
+                source = pa.memory_map(str(self.metadata_path), "r")
+                self._metadata = pa.ipc.open_file(source).read_all()
+                # Not combine_chunks(): that would copy each column onto the heap
+                self._content = self._metadata.column("content")
+                self._file = self._metadata.column("file")
+                if "token_count" in self._metadata.column_names:
+                    self._token_count = self._metadata.column("token_count")
+                schema_metadata = self._metadata.schema.metadata or {}
+                self._normalized = schema_metadata.get(NORMALIZED_METADATA_KEY) == b"true"
                 
-                print(f"✅ Loaded vector store with {len(self._metadata)} chunks")
+                print(f"✅ Loaded vector store with {self._metadata.num_rows} chunks")
             else:
                 print("⚠️ Vector store not found. Run ingestion first.")
         except Exception as e:
@@ -46,80 +90,128 @@ class RAGRetriever:
             import traceback
             traceback.print_exc()
     
+    def bind_client(self, client: Optional[httpx.AsyncClient]) -> None:
+        """Attach the shared HTTP client (``None`` detaches it on shutdown)."""
+        self._client = client
+    
     async def get_query_embedding(self, query: str) -> List[float]:
-        """Get embedding for search query."""
-        async with httpx.AsyncClient(timeout=180.0) as client:
-            response = await client.post(
-                f"{self.settings.ollama_host}/api/embeddings",
-                json={
-                    "model": self.settings.embedding_model,
-                    "prompt": query
-                }
-            )
-            response.raise_for_status()
-            return response.json()["embedding"]
+        """Get embedding for search query, batched with any concurrent queries."""
+        return await self._embed_batcher.process(query)
+    
+    async def _embed_batch(self, queries: List[str]) -> List[List[float]]:
+        """Embed several queries with a single call to Ollama's batch endpoint."""
+        if self._client is None:
+            raise RuntimeError("RAGRetriever has no HTTP client bound; is the app lifespan running?")
+        
+        response = await self._client.post(
+            "/api/embed",
+            json={
+                "model": self.settings.embedding_model,
+                "input": queries
+            },
+            timeout=180.0
+        )
+        response.raise_for_status()
+        return response.json()["embeddings"]
     
-    async def search_documents(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        """Search for relevant documents based on query."""
-        if not self._index or not self._metadata:
+    async def search_documents(
+        self, query: str, top_k: int = 5, query_embedding: Optional[List[float]] = None
+    ) -> List[Hit]:
+        """Search for relevant documents based on query (optionally pre-embedded).
+
+        Embedding and index errors propagate so callers can report them.
+        """
+        if self._index is None or self._metadata is None:
             return []
         
-        try:
-            print(f"🔍 Searching for: {query}")
-            
-            # Get query embedding
+        print(f"🔍 Searching for: {query}")
+        
+        # Get query embedding
+        if query_embedding is None:
             query_embedding = await self.get_query_embedding(query)
-            query_vector = np.array([query_embedding], dtype=np.float32)
-            
-            # Search in FAISS index
-            scores, indices = self._index.search(query_vector, top_k)
-            
-            # Retrieve relevant chunks
-            results = []
-            for score, idx in zip(scores[0], indices[0]):
-                if idx < len(self._metadata) and idx != -1:  # -1 indicates no more results
-                    chunk_data = self._metadata[idx].copy()
-                    chunk_data['similarity_score'] = float(score)
-                    results.append(chunk_data)
-            
-            print(f"✅ Found {len(results)} relevant chunks")
-            return results
-            
-        except Exception as e:
-            print(f"❌ Search error: {e}")
-            import traceback
-            traceback.print_exc()
-            return []
+        query_vector = np.array([query_embedding], dtype=np.float32)
+        if self._normalized:
+            # Match the unit-length index vectors so inner product is cosine similarity
+            faiss.normalize_L2(query_vector)
+        
+        # Widen the HNSW beam so recall holds for larger top_k; passed per call so
+        # concurrent searches with different top_k don't race on shared index state
+        params = None
+        if hasattr(self._index, "hnsw"):
+            params = faiss.SearchParametersHNSW(efSearch=max(MIN_EF_SEARCH, top_k * 8))
+        
+        # FAISS releases the GIL while searching, so run it off the event loop
+        scores, indices = await asyncio.to_thread(
+            self._index.search, query_vector, top_k, params=params
+        )
+        
+        # Retrieve relevant chunks
+        results = []
+        for score, idx in zip(scores[0], indices[0]):
+            if idx < self._metadata.num_rows and idx != -1:  # -1 indicates no more results
+                content = self._content[idx].as_py()
+                if self._token_count is not None:
+                    token_count = self._token_count[idx].as_py()
+                else:
+                    # Stores ingested before token counts were recorded
+                    token_count = estimate_tokens(content)
+                results.append(
+                    Hit(int(idx), float(score), content, self._file[idx].as_py(), token_count)
+                )
+        
+        print(f"✅ Found {len(results)} relevant chunks")
+        return results
+    
+    def describe(self, hit: Hit) -> Dict[str, Any]:
+        """Expand a hit into its full metadata row plus ``similarity_score``."""
+        chunk_data = self._metadata.slice(hit.idx, 1).to_pylist()[0]
+        chunk_data['similarity_score'] = hit.score
+        return chunk_data
     
     def is_available(self) -> bool:
         """Check if RAG system is ready."""
         return self._index is not None and self._metadata is not None
     
-    async def get_context_for_query(self, query: str, max_context_length: int = 2000) -> str:
-        """Get relevant context for a query."""
+    async def get_context_for_query(
+        self, query: str, max_context_tokens: int = 1500, query_embedding: Optional[List[float]] = None
+    ) -> Optional[str]:
+        """Get relevant context for a query, within a budget of chunk tokens.
+
+        Returns ``""`` when no vector store is loaded, and ``None`` when the query
+        is off-topic (no chunk is relevant enough). Embedding and search errors
+        are raised rather than reported as off-topic.
+        """
         if not self.is_available():
             return ""
         
-        results = await self.search_documents(query, top_k=5)
+        if query_embedding is None:
+            query_embedding = await self.get_query_embedding(query)
+        
+        # Similarity thresholds only mean something when scores are cosine similarities
+        if self._normalized and self._rejected.get(query_embedding) is not None:
+            print("↩️ Skipping retrieval for a known off-topic query")
+            return None
+        
+        results = await self.search_documents(query, top_k=5, query_embedding=query_embedding)
         
         if not results:
             return ""
         
+        if self._normalized and max(result.score for result in results) < MIN_RELEVANCE_SCORE:
+            self._rejected.add(query_embedding, _REJECTED)
+            return None
+        
         # Build context from top results
         context_parts = []
-        current_length = 0
+        total_tokens = 0
         
         for result in results:
-            content = result['content']
-            file_name = result['file']
-            
-            chunk_text = f"From {file_name}:\n{content}\n"
-            
-            if current_length + len(chunk_text) > max_context_length:
+            # Token counts are precomputed at ingest, so no tokenization happens per request
+            if total_tokens + result.token_count > max_context_tokens:
                 break
                 
-            context_parts.append(chunk_text)
-            current_length += len(chunk_text)
+            context_parts.append(f"From {result.file}:\n{result.content}\n")
+            total_tokens += result.token_count
         
         return "\n---\n".join(context_parts)
 
@@ -0,0 +1,65 @@
+"""Semantic response cache for PrajwalGPT RAG endpoints."""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+
+class SemanticCache:
+    """Reuses responses for queries whose embeddings are near-duplicates of earlier ones."""
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1024, ttl_seconds: float = 3600.0):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._index: Optional[faiss.IndexIDMap2] = None
+        # entry id -> (response, expiry on the monotonic clock), least recently used first
+        self._entries: "OrderedDict[int, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._next_id = 0
+
+    @staticmethod
+    def _as_vector(embedding: List[float]) -> np.ndarray:
+        vector = np.array([embedding], dtype=np.float32)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def get(self, embedding: List[float]) -> Optional[Dict[str, Any]]:
+        """Return the cached response for a similar query, if one is still fresh."""
+        if self._index is None or self._index.ntotal == 0:
+            return None
+
+        scores, ids = self._index.search(self._as_vector(embedding), 1)
+        entry_id = int(ids[0][0])
+        if entry_id == -1 or scores[0][0] < self.threshold:
+            return None
+
+        response, expires_at = self._entries[entry_id]
+        if expires_at < time.monotonic():
+            self._remove(entry_id)
+            return None
+
+        self._entries.move_to_end(entry_id)
+        return response
+
+    def add(self, embedding: List[float], response: Dict[str, Any]) -> None:
+        """Cache a response, evicting the least recently used entry when full."""
+        vector = self._as_vector(embedding)
+        if self._index is None:
+            self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+
+        entry_id = self._next_id
+        self._next_id += 1
+        self._index.add_with_ids(vector, np.array([entry_id], dtype=np.int64))
+        self._entries[entry_id] = (response, time.monotonic() + self.ttl_seconds)
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: int) -> None:
+        self._entries.pop(entry_id, None)
+        if self._index is not None:
+            self._index.remove_ids(np.array([entry_id], dtype=np.int64))
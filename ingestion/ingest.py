@@ -3,59 +3,160 @@
 from __future__ import annotations
 
 import asyncio
+import bisect
 import json
 import os
+import re
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
-from typing import Iterable, List, Dict, Any
+from typing import Iterable, Iterator, List, Dict, Any, Optional, Tuple
 import httpx
 import faiss
 import numpy as np
+import pyarrow as pa
+import tiktoken
 
-from shared import get_settings
+from shared import NORMALIZED_METADATA_KEY, estimate_tokens, get_settings
+from shared.config import Settings
+
+
+# Chunks sent to Ollama per /api/embed request, and how many requests may be in flight.
+EMBED_BATCH_SIZE = 32
+EMBED_CONCURRENCY = 8
+
+# Documents loaded, chunked and embedded at the same time.
+DOCUMENT_CONCURRENCY = 4
+
+# HNSW graph parameters: neighbours per node and build-time search breadth.
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 128
+
+# Tokenizer used to size chunks for the LLM context.
+TOKEN_ENCODING = "cl100k_base"
+
+# File types picked up from the documents directory.
+DOCUMENT_SUFFIXES = frozenset({".md", ".txt", ".pdf", ".py", ".json"})
+
+# Files kept next to the index so unchanged documents are not re-embedded.
+MANIFEST_FILENAME = "manifest.json"
+EMBEDDINGS_FILENAME = "embeddings.npy"
+
+_SENTENCE_BOUNDARY = re.compile(r"[.\n]")
+
+
+@lru_cache(maxsize=1)
+def _token_encoding() -> Optional[tiktoken.Encoding]:
+    try:
+        return tiktoken.get_encoding(TOKEN_ENCODING)
+    except Exception as e:
+        # The BPE file is downloaded on first use; fall back to an estimate offline
+        print(f"⚠️ Could not load {TOKEN_ENCODING} tokenizer ({e}), estimating token counts")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Return the number of tokens in ``text``, stored per chunk for context budgeting."""
+    encoding = _token_encoding()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
 
 
 class DocumentProcessor:
     """Handles document processing and vector storage."""
     
-    def __init__(self):
+    def __init__(self, client: httpx.AsyncClient):
         self.settings = get_settings()
         self.vector_store_path = Path(self.settings.vector_store_path)
         self.documents_path = Path("storage/documents")
         self.vector_store_path.mkdir(parents=True, exist_ok=True)
+        self._client = client
+        self._embed_semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+        self._document_semaphore = asyncio.Semaphore(DOCUMENT_CONCURRENCY)
         
-    async def get_embeddings(self, text: str) -> List[float]:
-        """Get embeddings from Ollama embedding model."""
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                f"{self.settings.ollama_host}/api/embeddings",
+    async def get_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed several texts with a single call to Ollama's batch endpoint."""
+        async with self._embed_semaphore:
+            response = await self._client.post(
+                "/api/embed",
                 json={
                     "model": self.settings.embedding_model,
-                    "prompt": text
+                    "input": texts
                 }
             )
             response.raise_for_status()
-            return response.json()["embedding"]
+            return response.json()["embeddings"]
+    
+    async def embed_chunks(self, chunks: List[str]) -> List[List[float]]:
+        """Embed all chunks, overlapping batched requests; output order matches input."""
+        batches = [
+            chunks[i:i + EMBED_BATCH_SIZE] for i in range(0, len(chunks), EMBED_BATCH_SIZE)
+        ]
+        results = await asyncio.gather(*(self.get_embeddings_batch(batch) for batch in batches))
+        return [embedding for batch in results for embedding in batch]
+    
+    async def process_document(
+        self, doc_path: Path
+    ) -> Optional[Tuple[List[List[float]], List[Dict[str, Any]]]]:
+        """Load, chunk and embed one document, returning its embeddings and metadata rows.
+
+        Empty documents yield no rows; ``None`` means embedding failed and the
+        document should be retried on the next run.
+        """
+        async with self._document_semaphore:
+            print(f"📖 Processing: {doc_path.name}")
+            
+            # Load document content
+            content = self.load_document(doc_path)
+            if not content:
+                return [], []
+                
+            # Split into chunks
+            chunks = self.chunk_text(content)
+            print(f"  ✂️ Split {doc_path.name} into {len(chunks)} chunks")
+            
+            # Embed all chunks of the document in batched, concurrent requests
+            try:
+                embeddings = await self.embed_chunks(chunks)
+            except Exception as e:
+                print(f"  ❌ Error embedding {doc_path.name}: {e}")
+                return None
+            
+            metadata = [
+                {
+                    "file": str(doc_path.name),
+                    "chunk_id": i,
+                    "content": chunk,
+                    "file_path": str(doc_path),
+                    "token_count": count_tokens(chunk)
+                }
+                for i, chunk in enumerate(chunks)
+            ]
+            
+            print(f"  ✅ Processed {len(embeddings)} chunks from {doc_path.name}")
+            return embeddings, metadata
     
     def chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 100) -> List[str]:
         """Split text into overlapping chunks."""
         chunks = []
         start = 0
         
+        # Offsets of every sentence boundary, found in one pass and bisected per window
+        boundaries = [match.start() for match in _SENTENCE_BOUNDARY.finditer(text)]
+        
         while start < len(text):
             end = start + chunk_size
-            chunk = text[start:end]
             
-            # Try to break at sentence boundaries
+            # Try to break at the last sentence boundary in the window
             if end < len(text):
-                last_period = chunk.rfind('.')
-                last_newline = chunk.rfind('\n')
-                break_point = max(last_period, last_newline)
-                
-                if break_point > start + chunk_size // 2:
-                    chunk = text[start:break_point + 1]
-                    end = break_point + 1
+                last = bisect.bisect_left(boundaries, end) - 1
+                if last >= 0 and boundaries[last] > start + chunk_size // 2:
+                    end = boundaries[last] + 1
             
-            chunks.append(chunk.strip())
+            chunks.append(text[start:end].strip())
+            if end >= len(text):
+                break
             start = end - overlap
             
         return [chunk for chunk in chunks if chunk]
@@ -78,15 +179,104 @@ class DocumentProcessor:
 
 def discover_documents(source_directory: Path) -> Iterable[Path]:
     """Yield documents from the given directory that should be ingested."""
-    for path in source_directory.glob("**/*"):
-        if path.is_file() and path.suffix.lower() in {".md", ".txt", ".pdf", ".py", ".json"}:
-            yield path
+    if not source_directory.is_dir():
+        return
+    
+    # os.scandir reuses the directory entry's cached type, avoiding a stat per path
+    stack = [str(source_directory)]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in DOCUMENT_SUFFIXES:
+                    yield Path(entry.path)
 
 
 async def main() -> None:
     """Process documents and create vector embeddings."""
-    processor = DocumentProcessor()
     settings = get_settings()
+    async with httpx.AsyncClient(base_url=settings.ollama_host, timeout=60.0) as client:
+        await ingest(DocumentProcessor(client), settings)
+
+
+@contextmanager
+def replacing(path: Path) -> Iterator[Path]:
+    """Yield a temporary path beside ``path`` and atomically move it over ``path`` on success."""
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def file_signature(path: Path) -> List[int]:
+    """Return the ``[mtime_ns, size]`` pair used to detect changed documents."""
+    stat = path.stat()
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def load_previous_store(
+    vector_store_path: Path, embedding_model: str
+) -> Dict[str, Tuple[List[int], np.ndarray, List[Dict[str, Any]]]]:
+    """Return ``(signature, embeddings, metadata rows)`` per file from the last ingest."""
+    manifest_path = vector_store_path / MANIFEST_FILENAME
+    embeddings_path = vector_store_path / EMBEDDINGS_FILENAME
+    metadata_path = vector_store_path / "metadata.arrow"
+    if not manifest_path.exists():
+        return {}
+    
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get("embedding_model") != embedding_model:
+            print("⚠️ Embedding model changed, re-embedding every document")
+            return {}
+        if manifest.get("chunks") == 0:
+            # Only empty documents were seen; there is no index to reuse
+            empty = np.empty((0, 0), dtype=np.float32)
+            return {file_path: (signature, empty, []) for file_path, signature in manifest["files"].items()}
+        if not (embeddings_path.exists() and metadata_path.exists()):
+            return {}
+        embeddings = np.load(embeddings_path)
+        metadata = pa.ipc.open_file(pa.memory_map(str(metadata_path), "r")).read_all().to_pylist()
+    except Exception as e:
+        print(f"⚠️ Ignoring previous vector store: {e}")
+        return {}
+    
+    if len(metadata) != len(embeddings):
+        print("⚠️ Previous vector store is inconsistent, re-embedding every document")
+        return {}
+    
+    rows_by_file: Dict[str, List[int]] = {}
+    for row, entry in enumerate(metadata):
+        rows_by_file.setdefault(entry["file_path"], []).append(row)
+    
+    # Files listed without rows are empty documents; they are reused as zero rows
+    previous = {}
+    for file_path, signature in manifest["files"].items():
+        rows = rows_by_file.get(file_path, [])
+        previous[file_path] = (signature, embeddings[rows], [metadata[row] for row in rows])
+    return previous
+
+
+def write_manifest(
+    vector_store_path: Path, embedding_model: str, files: Dict[str, List[int]], chunks: int
+) -> None:
+    """Record the file signatures and chunk count of the store just written."""
+    with replacing(vector_store_path / MANIFEST_FILENAME) as tmp_path:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(
+                {"embedding_model": embedding_model, "chunks": chunks, "files": files},
+                f,
+                indent=2,
+                ensure_ascii=False,
+            )
+
+
+async def ingest(processor: DocumentProcessor, settings: Settings) -> None:
+    """Embed new or changed documents and persist the vector store."""
     
     print("🚀 Starting document ingestion...")
     print(f"📁 Documents directory: {processor.documents_path}")
@@ -97,73 +287,122 @@ async def main() -> None:
     # Collect all documents
     documents = list(discover_documents(processor.documents_path))
     
+    # Reuse the previous run's embeddings for documents whose mtime and size are unchanged
+    previous = load_previous_store(processor.vector_store_path, settings.embedding_model)
+    
     if not documents:
         print("❌ No documents found in storage/documents/")
         print("📝 Add your documents (.txt, .md, .pdf, .py, .json) to storage/documents/ directory")
+        if not previous:
+            return
+    else:
+        print(f"📄 Found {len(documents)} documents")
+    
+    signatures = {str(doc_path): file_signature(doc_path) for doc_path in documents}
+    reused = {
+        key: (entry[1], entry[2])
+        for key, entry in previous.items()
+        if signatures.get(key) == entry[0]
+    }
+    changed = [doc_path for doc_path in documents if str(doc_path) not in reused]
+    removed = set(previous) - set(signatures)
+    
+    # A missing index is rebuilt from the saved embeddings rather than reported as up to date
+    index_missing = (
+        not (processor.vector_store_path / "faiss_index.bin").exists()
+        and any(entry[2] for entry in previous.values())
+    )
+    if previous and not changed and not removed and not index_missing:
+        print("✅ Vector store is already up to date")
         return
     
-    print(f"📄 Found {len(documents)} documents to process")
+    print(f"♻️ Reusing {len(reused)} unchanged documents, processing {len(changed)}, dropping {len(removed)}")
+    
+    # Load the tokenizer once up front: its first use may download the BPE file, which
+    # would otherwise block the event loop while embed requests are in flight
+    await asyncio.to_thread(_token_encoding)
+    
+    # Process changed documents concurrently; results come back in discovery order
+    results = await asyncio.gather(*(processor.process_document(doc_path) for doc_path in changed))
+    processed = {str(doc_path): result for doc_path, result in zip(changed, results)}
     
-    # Storage for embeddings and metadata
-    all_embeddings = []
+    # Storage for embeddings and metadata, assembled in discovery order
+    embedding_blocks = []
     all_metadata = []
+    manifest_files = {}
     
     for doc_path in documents:
-        print(f"📖 Processing: {doc_path.name}")
+        key = str(doc_path)
+        if key in reused:
+            doc_embeddings, doc_metadata = reused[key]
+            # Rows from stores written before token counts were recorded
+            for entry in doc_metadata:
+                if entry.get("token_count") is None:
+                    entry["token_count"] = count_tokens(entry["content"])
+        else:
+            result = processed[key]
+            if result is None:
+                # Embedding failed: leave it out of the manifest so the next run retries it
+                continue
+            new_embeddings, doc_metadata = result
+            doc_embeddings = np.array(new_embeddings, dtype=np.float32)
         
-        # Load document content
-        content = processor.load_document(doc_path)
-        if not content:
-            continue
-            
-        # Split into chunks
-        chunks = processor.chunk_text(content)
-        print(f"  ✂️ Split into {len(chunks)} chunks")
-        
-        # Process each chunk
-        for i, chunk in enumerate(chunks):
-            try:
-                # Get embeddings
-                embedding = await processor.get_embeddings(chunk)
-                
-                # Store embedding and metadata
-                all_embeddings.append(embedding)
-                all_metadata.append({
-                    "file": str(doc_path.name),
-                    "chunk_id": i,
-                    "content": chunk,
-                    "file_path": str(doc_path)
-                })
-                
-                print(f"  ✅ Processed chunk {i+1}/{len(chunks)}")
-                
-            except Exception as e:
-                print(f"  ❌ Error processing chunk {i}: {e}")
+        # Empty documents are still recorded so unchanged ones are skipped next time
+        manifest_files[key] = signatures[key]
+        if doc_metadata:
+            embedding_blocks.append(doc_embeddings)
+            all_metadata.extend(doc_metadata)
     
-    if not all_embeddings:
-        print("❌ No embeddings generated")
+    if not embedding_blocks:
+        # Nothing left to index: drop the old store so deleted documents stop matching
+        for filename in ("faiss_index.bin", "metadata.arrow", EMBEDDINGS_FILENAME):
+            (processor.vector_store_path / filename).unlink(missing_ok=True)
+        write_manifest(processor.vector_store_path, settings.embedding_model, manifest_files, 0)
+        print("⚠️ No chunks to index, cleared the vector store")
         return
     
     # Create FAISS index
     print("🔧 Creating FAISS vector index...")
-    embeddings_array = np.array(all_embeddings, dtype=np.float32)
+    embeddings_array = np.concatenate(embedding_blocks).astype(np.float32, copy=False)
     
     # Create index
     dimension = embeddings_array.shape[1]
-    index = faiss.IndexFlatIP(dimension)  # Inner product for similarity
+    # Unit-length vectors make inner product equal cosine and keep values in the SQ8 range
+    faiss.normalize_L2(embeddings_array)
+    index = faiss.IndexHNSWSQ(
+        dimension, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT
+    )  # Inner product for similarity, 8-bit scalar-quantized storage
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.train(embeddings_array)
     index.add(embeddings_array)
     
     # Save index and metadata
     index_path = processor.vector_store_path / "faiss_index.bin"
-    metadata_path = processor.vector_store_path / "metadata.json"
+    metadata_path = processor.vector_store_path / "metadata.arrow"
+    
+    # Every file is written beside its target and swapped in, so a running backend
+    # that has the old files open (metadata is memory-mapped) never sees them truncated
+    with replacing(index_path) as tmp_path:
+        faiss.write_index(index, str(tmp_path))
     
-    faiss.write_index(index, str(index_path))
+    # Uncompressed Arrow IPC so the backend can memory-map it without decoding
+    # Schema metadata records that vectors were L2-normalised, so queries must be too
+    metadata_table = pa.Table.from_pylist(all_metadata).replace_schema_metadata(
+        {NORMALIZED_METADATA_KEY: b"true"}
+    )
+    with replacing(metadata_path) as tmp_path:
+        with pa.OSFile(str(tmp_path), "wb") as sink:
+            with pa.ipc.new_file(sink, metadata_table.schema) as writer:
+                writer.write_table(metadata_table)
     
-    with open(metadata_path, 'w', encoding='utf-8') as f:
-        json.dump(all_metadata, f, indent=2, ensure_ascii=False)
+    # Full-precision vectors and file signatures let the next run skip unchanged files
+    with replacing(processor.vector_store_path / EMBEDDINGS_FILENAME) as tmp_path:
+        with open(tmp_path, 'wb') as f:
+            np.save(f, embeddings_array)
+    write_manifest(processor.vector_store_path, settings.embedding_model, manifest_files, len(all_metadata))
     
     print(f"✅ Vector store created successfully!")
-    print(f"📊 Indexed {len(all_embeddings)} chunks from {len(documents)} documents")
+    print(f"📊 Indexed {len(embeddings_array)} chunks from {len(manifest_files)} documents")
     print(f"💾 Saved to: {processor.vector_store_path}")
 
 
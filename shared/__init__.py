@@ -1,5 +1,6 @@
 """Shared utilities and configuration for PrajwalGPT services."""
 
-from .config import get_settings, settings
+from .config import get_settings
+from .vector_store import NORMALIZED_METADATA_KEY, estimate_tokens
 
-__all__ = ("get_settings", "settings")
+__all__ = ("NORMALIZED_METADATA_KEY", "estimate_tokens", "get_settings")
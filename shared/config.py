@@ -4,37 +4,40 @@ from __future__ import annotations
 
 import json
 import os
-from dataclasses import asdict, dataclass
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Callable, Dict
 
 from dotenv import load_dotenv
 
 _DEFAULTS_PATH = Path(__file__).with_name("constants.json")
 
 
+@lru_cache(maxsize=1)
 def _load_defaults() -> Dict[str, Any]:
     with _DEFAULTS_PATH.open("r", encoding="utf-8") as fp:
         return json.load(fp)
 
 
-_DEFAULTS = _load_defaults()
+def _env(name: str, cast: Callable[[str], Any] = str) -> Callable[[], Any]:
+    """Build a field factory reading ``name`` from the environment or the defaults."""
 
-# Load environment variables from a local .env file if present.
-load_dotenv()
+    return lambda: cast(os.getenv(name, str(_load_defaults()[name])))
 
 
 @dataclass(frozen=True, slots=True)
 class Settings:
     """Shared configuration values consumed by every service."""
 
-    ollama_host: str = os.getenv("OLLAMA_HOST", _DEFAULTS["OLLAMA_HOST"])
-    ollama_model: str = os.getenv("OLLAMA_MODEL", _DEFAULTS["OLLAMA_MODEL"])
-    embedding_model: str = os.getenv("EMBEDDING_MODEL", _DEFAULTS["EMBEDDING_MODEL"])
-    vector_store_path: str = os.getenv("VECTOR_STORE_PATH", _DEFAULTS["VECTOR_STORE_PATH"])
-    api_base_url: str = os.getenv("API_BASE_URL", _DEFAULTS["API_BASE_URL"])
-    api_port: int = int(os.getenv("API_PORT", _DEFAULTS["API_PORT"]))
-    frontend_base_url: str = os.getenv("FRONTEND_BASE_URL", _DEFAULTS["FRONTEND_BASE_URL"])
+    ollama_host: str = field(default_factory=_env("OLLAMA_HOST"))
+    ollama_model: str = field(default_factory=_env("OLLAMA_MODEL"))
+    embedding_model: str = field(default_factory=_env("EMBEDDING_MODEL"))
+    ollama_keep_alive: str = field(default_factory=_env("OLLAMA_KEEP_ALIVE"))
+    vector_store_path: str = field(default_factory=_env("VECTOR_STORE_PATH"))
+    api_base_url: str = field(default_factory=_env("API_BASE_URL"))
+    api_port: int = field(default_factory=_env("API_PORT", int))
+    frontend_base_url: str = field(default_factory=_env("FRONTEND_BASE_URL"))
 
     def to_dict(self) -> Dict[str, Any]:
         """Return a serialisable representation of the settings."""
@@ -42,16 +45,10 @@ class Settings:
         return asdict(self)
 
 
-_settings: Settings | None = None
-
-
+@lru_cache(maxsize=1)
 def get_settings() -> Settings:
     """Return a cached instance of :class:`Settings`."""
 
-    global _settings
-    if _settings is None:
-        _settings = Settings()
-    return _settings
-
-
-settings = get_settings()
+    # Load environment variables from a local .env file if present.
+    load_dotenv()
+    return Settings()
@@ -0,0 +1,14 @@
+"""Vector store layout shared by the ingestion pipeline and the backend."""
+
+from __future__ import annotations
+
+# Arrow schema metadata key set to b"true" when the index holds unit-length vectors.
+NORMALIZED_METADATA_KEY = b"normalized"
+
+# Rough characters-per-token ratio, used when no tokenizer is available.
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate the token count of ``text`` from its length."""
+    return len(text) // CHARS_PER_TOKEN + 1